@@ -24,6 +24,7 @@ This module contains default platform-specific implementations of system tasks.
 
 from __future__ import absolute_import
 
+import contextlib
 import os
 import logging
 import textwrap
@@ -57,6 +58,15 @@ class BaseTaskNamespace:
         """
         raise NotImplementedError()
 
+    @contextlib.contextmanager
+    def batched_restorecon(self):
+        """Restore SELinux security contexts of files at once.
+
+        restore_context() calls made inside the block may be deferred until
+        the block exits. Platforms without batching relabel immediately.
+        """
+        yield
+
     def backup_hostname(self, fstore, statestore):
         """
         Backs up the current hostname in the statestore (so that it can be
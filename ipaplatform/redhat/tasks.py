@@ -25,24 +25,19 @@ system tasks.
 '''
 from __future__ import print_function, absolute_import
 
+import contextlib
 import ctypes
 import logging
 import os
 from pathlib import Path
-import socket
-import traceback
+import re
 import errno
-import urllib
 import subprocess
 import sys
-import textwrap
 
-from ctypes.util import find_library
-from functools import total_ordering
+from functools import lru_cache, total_ordering
 from subprocess import CalledProcessError
 
-from pyasn1.error import PyAsn1Error
-
 from ipapython import directivesetter
 from ipapython import ipautil
 import ipapython.errors
@@ -63,37 +58,112 @@ PKCS11_MODULES = [
 ]
 
 
-NM_IPA_CONF = textwrap.dedent("""
-    # auto-generated by IPA installer
-    [main]
-    dns={dnsprocessing}
+NM_IPA_CONF = """
+# auto-generated by IPA installer
+[main]
+dns={dnsprocessing}
 
-    [global-dns]
-    searches={searches}
+[global-dns]
+searches={searches}
 
-    [global-dns-domain-*]
-    servers={servers}
-""")
+[global-dns-domain-*]
+servers={servers}
+"""
 
 
-@total_ordering
-class IPAVersion:
-    _rpmvercmp_func = None
+# p11-kit trust objects written by write_p11kit_certs()
+P11KIT_CERT_OBJECT = (
+    "[p11-kit-object-v1]\n"
+    "class: certificate\n"
+    "certificate-type: x-509\n"
+    "certificate-category: authority\n"
+    "label: \"{label}\"\n"
+    "subject: \"{subject}\"\n"
+    "issuer: \"{issuer}\"\n"
+    "serial-number: \"{serial_number}\"\n"
+    "x-public-key-info: \"{public_key_info}\"\n"
+)
+
+P11KIT_EKU_OBJECT = (
+    "[p11-kit-object-v1]\n"
+    "class: x-certificate-extension\n"
+    "label: \"ExtendedKeyUsage for {label}\"\n"
+    "x-public-key-info: \"{public_key_info}\"\n"
+    "object-id: 2.5.29.37\n"
+    "value: \"{value}\"\n\n"
+)
+
+
+# ::1 as listed in /proc/net/if_inet6
+IF_INET6_LOCALHOST = "00000000000000000000000000000001"
+
+# existing NISDOMAIN assignments in /etc/sysconfig/network, leading
+# whitespace other than newlines is ignored like str.strip() does
+_NISDOMAIN_RE = re.compile(
+    r'^[^\S\n]*NISDOMAIN[^\S\n]*=.*(?:\n|$)', re.IGNORECASE | re.MULTILINE
+)
+
+
+def _open_0644(path, flags):
+    """open() opener that creates files with mode 0644
+
+    Callers still fchmod() the file, the mode is subject to the umask and
+    only applies to newly created files.
+    """
+    return os.open(path, flags, 0o644)
+
+
+def _file_content_equals(path, content):
+    """Check whether a file exists and contains exactly content
+
+    :param content: expected file content as str
+    """
+    try:
+        return Path(path).read_bytes() == content.encode('utf-8')
+    except OSError:
+        return False
 
-    @classmethod
-    def _rpmvercmp(cls, a, b):
-        """Lazy load and call librpm's rpmvercmp
-        """
-        rpmvercmp_func = cls._rpmvercmp_func
-        if rpmvercmp_func is None:
-            librpm = ctypes.CDLL(find_library('rpm'))
-            rpmvercmp_func = librpm.rpmvercmp
-            # int rpmvercmp(const char *a, const char *b)
-            rpmvercmp_func.argtypes = [ctypes.c_char_p, ctypes.c_char_p]
-            rpmvercmp_func.restype = ctypes.c_int
-            cls._rpmvercmp_func = rpmvercmp_func
-        return rpmvercmp_func(a, b)
 
+@lru_cache(maxsize=None)
+def _resolve_bin(path):
+    """Return path if it is an executable file, None otherwise
+
+    Results are cached, system binaries don't come and go while IPA runs.
+    """
+    return path if os.access(path, os.X_OK) else None
+
+
+_RPMVERCMP = None
+
+
+def _load_rpmvercmp():
+    """Load librpm's rpmvercmp once and bind it process-wide
+    """
+    global _RPMVERCMP
+    if _RPMVERCMP is None:
+        # ctypes.util is expensive to import, only pay for it when needed
+        from ctypes.util import find_library
+        librpm = ctypes.CDLL(find_library('rpm'))
+        rpmvercmp_func = librpm.rpmvercmp
+        # int rpmvercmp(const char *a, const char *b)
+        rpmvercmp_func.argtypes = [ctypes.c_char_p, ctypes.c_char_p]
+        rpmvercmp_func.restype = ctypes.c_int
+        _RPMVERCMP = rpmvercmp_func
+    return _RPMVERCMP
+
+
+@lru_cache(maxsize=1024)
+def _rpmvercmp(a, b):
+    """Compare two version byte strings with librpm's rpmvercmp
+
+    Results are memoized, upgrade tooling compares the same pairs over
+    and over again.
+    """
+    return (_RPMVERCMP or _load_rpmvercmp())(a, b)
+
+
+@total_ordering
+class IPAVersion:
     def __init__(self, version):
         self._version = version
         self._bytes = version.encode('utf-8')
@@ -105,18 +175,60 @@ class IPAVersion:
     def __eq__(self, other):
         if not isinstance(other, IPAVersion):
             return NotImplemented
-        return self._rpmvercmp(self._bytes, other._bytes) == 0
+        return _rpmvercmp(self._bytes, other._bytes) == 0
 
     def __lt__(self, other):
         if not isinstance(other, IPAVersion):
             return NotImplemented
-        return self._rpmvercmp(self._bytes, other._bytes) < 0
+        return _rpmvercmp(self._bytes, other._bytes) < 0
 
     def __hash__(self):
         return hash(self._version)
 
 
+# marker for cached values that have not been computed yet
+_UNSET = object()
+
+LIBSELINUX_SONAME = 'libselinux.so.1'
+_LIBSELINUX = _UNSET
+
+
+def _load_libselinux():
+    """Lazy load libselinux
+
+    :returns: ctypes.CDLL or None if libselinux is not available
+    """
+    global _LIBSELINUX
+    if _LIBSELINUX is _UNSET:
+        # Load the soname directly, ctypes.util.find_library() would fork
+        # ldconfig and defeat the purpose.
+        try:
+            libselinux = ctypes.CDLL(LIBSELINUX_SONAME)
+        except OSError as e:
+            logger.debug("Failed to load %s: %s", LIBSELINUX_SONAME, e)
+            libselinux = None
+        else:
+            # int is_selinux_enabled(void)
+            libselinux.is_selinux_enabled.argtypes = []
+            libselinux.is_selinux_enabled.restype = ctypes.c_int
+            # int security_get_boolean_active(const char *name)
+            func = libselinux.security_get_boolean_active
+            func.argtypes = [ctypes.c_char_p]
+            func.restype = ctypes.c_int
+        _LIBSELINUX = libselinux
+    return _LIBSELINUX
+
+
 class RedHatTaskNamespace(BaseTaskNamespace):
+    # cached results of is_selinux_enabled(), detect_container() and
+    # is_fips_enabled()
+    _selinux_enabled = None
+    _fips_enabled = None
+    _container = _UNSET
+    # True when restore_context() has nothing to do
+    _restore_context_noop = None
+    # files queued for restorecon inside batched_restorecon()
+    _pending_restorecon = None
 
     def restore_context(self, filepath, force=False):
         """Restore SELinux security context on the given filepath.
@@ -127,32 +239,96 @@ class RedHatTaskNamespace(BaseTaskNamespace):
 
         ipautil.run() will do the logging.
         """
-        restorecon = paths.SBIN_RESTORECON
-        if not self.is_selinux_enabled() or not os.path.exists(restorecon):
+        noop = self._restore_context_noop
+        if noop is None:
+            # neither SELinux state nor restorecon change at runtime
+            noop = self._restore_context_noop = (
+                not self.is_selinux_enabled()
+                or _resolve_bin(paths.SBIN_RESTORECON) is None
+            )
+        if noop:
             return
 
+        if self._pending_restorecon is not None:
+            # inside batched_restorecon(), relabel on exit
+            self._pending_restorecon.append((filepath, force))
+            return
+
+        self._run_restorecon([filepath], force)
+
+    def _run_restorecon(self, filepaths, force=False):
         # Force reset of context to match file_context for customizable
         # files, and the default file context, changing the user, role,
         # range portion as well as the type.
-        args = [restorecon]
+        args = [paths.SBIN_RESTORECON]
         if force:
             args.append('-F')
-        args.append(filepath)
+        args.extend(filepaths)
         ipautil.run(args, raiseonerr=False)
 
+    @contextlib.contextmanager
+    def batched_restorecon(self):
+        """Restore SELinux contexts of files in a single restorecon run
+
+        restore_context() calls made inside the block are queued and
+        flushed when the outermost block exits.
+        """
+        if self._pending_restorecon is not None:
+            # nested block, the outermost one flushes
+            yield
+            return
+
+        self._pending_restorecon = []
+        try:
+            yield
+        finally:
+            try:
+                self.flush_restore_context()
+            finally:
+                self._pending_restorecon = None
+
+    def flush_restore_context(self):
+        """Run restorecon for all files queued by restore_context()
+        """
+        pending = self._pending_restorecon
+        if not pending:
+            return
+        self._pending_restorecon = []
+
+        for force in (False, True):
+            # dict keeps order and drops duplicates
+            filepaths = list(dict.fromkeys(
+                filepath for filepath, f in pending if f == force
+            ))
+            if filepaths:
+                self._run_restorecon(filepaths, force)
+
     def is_selinux_enabled(self):
         """Check if SELinux is available and enabled
+
+        The result is cached, SELinux cannot be switched on or off without
+        a reboot.
         """
-        try:
-            ipautil.run([paths.SELINUXENABLED])
-        except ipautil.CalledProcessError:
-            # selinuxenabled returns 1 if not enabled
-            return False
-        except OSError:
-            # selinuxenabled binary not available
-            return False
-        else:
-            return True
+        if self._selinux_enabled is None:
+            libselinux = _load_libselinux()
+            if libselinux is not None:
+                # same check as the selinuxenabled binary, without a fork
+                self._selinux_enabled = libselinux.is_selinux_enabled() > 0
+            elif _resolve_bin(paths.SELINUXENABLED) is None:
+                # selinuxenabled binary not available, don't bother forking
+                self._selinux_enabled = False
+            else:
+                try:
+                    ipautil.run([paths.SELINUXENABLED])
+                except ipautil.CalledProcessError:
+                    # selinuxenabled returns 1 if not enabled
+                    self._selinux_enabled = False
+                except OSError:
+                    # selinuxenabled binary not available
+                    self._selinux_enabled = False
+                else:
+                    self._selinux_enabled = True
+        return self._selinux_enabled
 
     def check_selinux_status(self, restorecon=paths.RESTORECON):
         """
@@ -189,6 +365,16 @@ class RedHatTaskNamespace(BaseTaskNamespace):
                 "globally, disable it on the specific interfaces in "
                 "sysctl.conf except 'lo' interface.")
 
+        # Every line of if_inet6 starts with an assigned address as 32 hex
+        # digits, look for ::1 there before asking the IP stack.
+        try:
+            with open(paths.IF_INET6) as f:
+                for line in f:
+                    if line.startswith(IF_INET6_LOCALHOST):
+                        return
+        except OSError:
+            pass
+
         try:
             localhost6 = ipautil.CheckedIPAddress('::1', allow_loopback=True)
             if localhost6.get_matching_interface() is None:
@@ -203,22 +389,28 @@ class RedHatTaskNamespace(BaseTaskNamespace):
     def detect_container(self):
         """Check if running inside a container
 
+        The result is cached, the container runtime of a process does not
+        change.
+
         :returns: container runtime or None
         :rtype: str, None
         """
-        try:
-            output = subprocess.check_output(
-                [paths.SYSTEMD_DETECT_VIRT, '--container'],
-                stderr=subprocess.STDOUT
-            )
-        except subprocess.CalledProcessError as e:
-            if e.returncode == 1:
-                # No container runtime detected
-                return None
-            else:
-                raise
+        if self._container is not _UNSET:
+            return self._container
+        result = subprocess.run(
+            [paths.SYSTEMD_DETECT_VIRT, '--container'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            encoding='utf-8',
+            check=False
+        )
+        if result.returncode == 1:
+            # No container runtime detected
+            self._container = None
         else:
-            return output.decode('utf-8').strip()
+            result.check_returncode()
+            self._container = result.stdout.strip()
+        return self._container
 
     def restore_pre_ipa_client_configuration(self, fstore, statestore,
                                              was_sssd_installed,
@@ -230,19 +422,15 @@ class RedHatTaskNamespace(BaseTaskNamespace):
         )
 
     def set_nisdomain(self, nisdomain):
+        path = Path(paths.SYSCONF_NETWORK)
         try:
-            with open(paths.SYSCONF_NETWORK, 'r') as f:
-                content = [
-                    line for line in f
-                    if not line.strip().upper().startswith('NISDOMAIN')
-                ]
+            content = _NISDOMAIN_RE.sub('', path.read_text())
         except IOError:
-            content = []
-
-        content.append("NISDOMAIN={}\n".format(nisdomain))
+            content = ''
+        if content and not content.endswith('\n'):
+            content += '\n'
 
-        with open(paths.SYSCONF_NETWORK, 'w') as f:
-            f.writelines(content)
+        path.write_text(content + "NISDOMAIN={}\n".format(nisdomain))
 
     def modify_nsswitch_pam_stack(self, sssd, mkhomedir, statestore,
                                   sudo=True, subid=False):
@@ -310,25 +498,28 @@ class RedHatTaskNamespace(BaseTaskNamespace):
         from ipalib import x509  # FixMe: break import cycle
         from ipalib.errors import CertificateError
         # pylint: enable=ipa-forbidden-import
+        from pyasn1.error import PyAsn1Error
+        from urllib.parse import quote, quote_from_bytes
 
         path = Path(filename)
         try:
-            f = open(path, 'w')
+            f = open(path, 'w', opener=_open_0644)
         except IOError:
             logger.error("Failed to open %s", path)
             raise
 
         with f:
-            f.write("# This file was created by IPA. Do not edit.\n"
-                    "\n")
-
             try:
                 os.fchmod(f.fileno(), 0o644)
             except IOError:
                 logger.error("Failed to set mode of %s", path)
                 raise
 
+            format_cert = P11KIT_CERT_OBJECT.format
+            format_eku = P11KIT_EKU_OBJECT.format
+            parts = ["# This file was created by IPA. Do not edit.\n\n"]
             has_eku = set()
+            pem_cache = {}
             for cert, nickname, trusted, _ext_key_usage in ca_certs:
                 try:
                     subject = cert.subject_bytes
@@ -340,34 +531,31 @@ class RedHatTaskNamespace(BaseTaskNamespace):
                         "Failed to decode certificate \"%s\"", nickname)
                     raise
 
-                label = urllib.parse.quote(nickname)
-                subject = urllib.parse.quote(subject)
-                issuer = urllib.parse.quote(issuer)
-                serial_number = urllib.parse.quote(serial_number)
-                public_key_info = urllib.parse.quote(public_key_info)
-
-                obj = ("[p11-kit-object-v1]\n"
-                       "class: certificate\n"
-                       "certificate-type: x-509\n"
-                       "certificate-category: authority\n"
-                       "label: \"%(label)s\"\n"
-                       "subject: \"%(subject)s\"\n"
-                       "issuer: \"%(issuer)s\"\n"
-                       "serial-number: \"%(serial_number)s\"\n"
-                       "x-public-key-info: \"%(public_key_info)s\"\n" %
-                       dict(label=label,
-                            subject=subject,
-                            issuer=issuer,
-                            serial_number=serial_number,
-                            public_key_info=public_key_info))
+                label = quote(nickname)
+                subject = quote_from_bytes(subject)
+                issuer = quote_from_bytes(issuer)
+                serial_number = quote_from_bytes(serial_number)
+                public_key_info = quote_from_bytes(public_key_info)
+
+                parts.append(format_cert(
+                    label=label,
+                    subject=subject,
+                    issuer=issuer,
+                    serial_number=serial_number,
+                    public_key_info=public_key_info,
+                ))
                 if trusted is True:
-                    obj += "trusted: true\n"
+                    parts.append("trusted: true\n")
                 elif trusted is False:
-                    obj += "x-distrusted: true\n"
-                obj += "{pem}\n\n".format(
-                    pem=cert.public_bytes(x509.Encoding.PEM).decode('ascii'))
-
-                f.write(obj)
+                    parts.append("x-distrusted: true\n")
+                # the same CA may be listed under several nicknames, encode
+                # each certificate only once
+                pem = pem_cache.get(cert)
+                if pem is None:
+                    pem = cert.public_bytes(x509.Encoding.PEM).decode('ascii')
+                    pem_cache[cert] = pem
+                parts.append(pem)
+                parts.append("\n\n")
 
                 if (cert.extended_key_usage is not None and
                         public_key_info not in has_eku):
@@ -378,19 +566,16 @@ class RedHatTaskNamespace(BaseTaskNamespace):
                             "Failed to encode extended key usage for \"%s\"",
                             nickname)
                         raise
-                    value = urllib.parse.quote(ext_key_usage)
-                    obj = ("[p11-kit-object-v1]\n"
-                           "class: x-certificate-extension\n"
-                           "label: \"ExtendedKeyUsage for %(label)s\"\n"
-                           "x-public-key-info: \"%(public_key_info)s\"\n"
-                           "object-id: 2.5.29.37\n"
-                           "value: \"%(value)s\"\n\n" %
-                           dict(label=label,
-                                public_key_info=public_key_info,
-                                value=value))
-                    f.write(obj)
+                    value = quote_from_bytes(ext_key_usage)
+                    parts.append(format_eku(
+                        label=label,
+                        public_key_info=public_key_info,
+                        value=value,
+                    ))
                     has_eku.add(public_key_info)
 
+            f.write("".join(parts))
+
         return True
 
     def platform_remove_ca_certs(self):
@@ -413,6 +598,8 @@ class RedHatTaskNamespace(BaseTaskNamespace):
         return True
 
     def backup_hostname(self, fstore, statestore):
+        import socket
+
         filepath = paths.ETC_HOSTNAME
         if os.path.exists(filepath):
             fstore.backup_file(filepath)
@@ -422,6 +609,8 @@ class RedHatTaskNamespace(BaseTaskNamespace):
         statestore.backup_state('network', 'hostname', old_hostname)
 
     def restore_hostname(self, fstore, statestore):
+        import traceback
+
         old_hostname = statestore.restore_state('network', 'hostname')
 
         if old_hostname is not None:
@@ -438,6 +627,40 @@ class RedHatTaskNamespace(BaseTaskNamespace):
         if fstore.has_file(filepath):
             fstore.restore_file(filepath)
 
+    def _get_selinux_booleans(self, names):
+        """Get the current state of SELinux booleans
+
+        :param names: names of the booleans to look up
+        :returns: dict mapping boolean names to 'on' / 'off', booleans that
+                  cannot be read are left out
+        """
+        libselinux = _load_libselinux()
+        if libselinux is not None:
+            states = {}
+            for name in names:
+                active = libselinux.security_get_boolean_active(
+                    name.encode('utf-8'))
+                if active >= 0:
+                    states[name] = 'on' if active else 'off'
+            return states
+
+        try:
+            result = ipautil.run(
+                [paths.GETSEBOOL, '-a'],
+                capture_output=True
+            )
+        except ipautil.CalledProcessError as e:
+            logger.debug("Cannot list SELinux booleans: %s", e)
+            return {}
+
+        states = {}
+        # output lines look like "httpd_can_network_connect --> off"
+        for line in result.output.splitlines():
+            parts = line.split()
+            if len(parts) == 3:
+                states[parts[0]] = parts[2]
+        return states
+
     def set_selinux_booleans(self, required_settings, backup_func=None):
         def get_setsebool_args(changes):
             args = [paths.SETSEBOOL, "-P"]
@@ -448,17 +671,28 @@ class RedHatTaskNamespace(BaseTaskNamespace):
         if not self.is_selinux_enabled():
             return False
 
+        required_settings = {
+            setting: state for setting, state in required_settings.items()
+            if state is not None
+        }
+        # look up all booleans at once, getsebool is only forked for
+        # booleans whose state could not be read
+        current_states = (
+            self._get_selinux_booleans(required_settings)
+            if required_settings else {}
+        )
+
         updated_vars = {}
         failed_vars = {}
         for setting, state in required_settings.items():
-            if state is None:
-                continue
             try:
-                result = ipautil.run(
-                    [paths.GETSEBOOL, setting],
-                    capture_output=True
-                )
-                original_state = result.output.split()[2]
+                original_state = current_states.get(setting)
+                if original_state is None:
+                    result = ipautil.run(
+                        [paths.GETSEBOOL, setting],
+                        capture_output=True
+                    )
+                    original_state = result.output.split()[2]
                 if backup_func is not None:
                     backup_func(setting, original_state)
 
@@ -593,17 +827,23 @@ class RedHatTaskNamespace(BaseTaskNamespace):
         Returns a boolean indicating if the host is FIPS-enabled, i.e. if the
         file /proc/sys/crypto/fips_enabled contains a non-0 value. Otherwise,
         or if the file /proc/sys/crypto/fips_enabled does not exist,
-        the function returns False.
+        the function returns False. The FIPS mode of a running system
+        does not change, the result is cached.
         """
-        try:
-            with open(paths.PROC_FIPS_ENABLED, 'r') as f:
-                if f.read().strip() != '0':
-                    return True
-        except IOError:
-            # Consider that the host is not fips-enabled if the file does not
-            # exist
-            pass
-        return False
+        if self._fips_enabled is None:
+            try:
+                fd = os.open(paths.PROC_FIPS_ENABLED, os.O_RDONLY)
+                try:
+                    # the file contains a single digit and a newline
+                    value = os.read(fd, 2)
+                finally:
+                    os.close(fd)
+            except OSError:
+                # Consider that the host is not fips-enabled if the file
+                # does not exist
+                value = b'0'
+            self._fips_enabled = value.strip() != b'0'
+        return self._fips_enabled
 
     def setup_httpd_logging(self):
         directivesetter.set_directive(paths.HTTPD_SSL_CONF,
@@ -660,10 +900,17 @@ class RedHatTaskNamespace(BaseTaskNamespace):
                 servers=','.join(nameservers),
                 searches=','.join(searchdomains)
             )
-            with open(paths.NETWORK_MANAGER_IPA_CONF, 'w') as f:
-                os.fchmod(f.fileno(), 0o644)
-                f.write(cfg)
-            # reload NetworkManager
+            if _file_content_equals(paths.NETWORK_MANAGER_IPA_CONF, cfg):
+                logger.debug(
+                    "%s is unchanged", paths.NETWORK_MANAGER_IPA_CONF
+                )
+            else:
+                with open(paths.NETWORK_MANAGER_IPA_CONF, 'w',
+                          opener=_open_0644) as f:
+                    os.fchmod(f.fileno(), 0o644)
+                    f.write(cfg)
+            # Always reload NetworkManager. A previous run may have written
+            # the file but never got NM to apply it.
             nm.reload_or_restart()
 
         if not resolve1_enabled and not nm_enabled:
@@ -673,14 +920,22 @@ class RedHatTaskNamespace(BaseTaskNamespace):
                 "Neither Network Manager nor systemd-resolved are enabled, "
                 "write %s directly.", paths.RESOLV_CONF
             )
-            cfg = [
-                "# auto-generated by IPA installer",
-                "search {}".format(' '.join(searchdomains)),
-            ]
-            for nameserver in nameservers:
-                cfg.append("nameserver {}".format(nameserver))
-            with open(paths.RESOLV_CONF, 'w') as f:
-                f.write('\n'.join(cfg))
+            cfg = (
+                "# auto-generated by IPA installer\n"
+                f"search {' '.join(searchdomains)}\n"
+            ) + "".join(
+                f"nameserver {nameserver}\n" for nameserver in nameservers
+            )
+            if _file_content_equals(paths.RESOLV_CONF, cfg):
+                logger.debug("%s is unchanged", paths.RESOLV_CONF)
+                return
+            fd = os.open(
+                paths.RESOLV_CONF, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644
+            )
+            try:
+                os.write(fd, cfg.encode('utf-8'))
+            finally:
+                os.close(fd)
 
     def unconfigure_dns_resolver(self, fstore=None):
         """Unconfigure global DNS resolver (e.g. /etc/resolv.conf)
@@ -697,36 +952,59 @@ class RedHatTaskNamespace(BaseTaskNamespace):
             if nm.is_enabled():
                 nm.reload_or_restart()
 
-    def configure_pkcs11_modules(self, fstore):
-        """Disable global p11-kit configuration for NSS
+    def _configure_pkcs11_module(self, fstore, name, module, disabled_in):
+        """Write IPA's PKCS#11 module config for a single module
         """
-        filenames = []
-        for name, module, disabled_in in PKCS11_MODULES:
-            filename = os.path.join(
-                paths.ETC_PKCS11_MODULES_DIR,
-                "{}.module".format(name)
-            )
-            if os.path.isfile(filename):
+        filename = os.path.join(
+            paths.ETC_PKCS11_MODULES_DIR,
+            "{}.module".format(name)
+        )
+        try:
+            f = open(filename, "r+")
+        except FileNotFoundError:
+            f = open(filename, "w", opener=_open_0644)
+            existing = False
+        else:
+            existing = True
+
+        with f:
+            if existing:
                 # Only back up if file is not yet backed up and it does not
                 # look like a file that is generated by IPA.
-                with open(filename) as f:
+                if os.fstat(f.fileno()).st_size:
                     content = f.read()
+                else:
+                    content = ""
                 is_ipa_file = "IPA" in content
                 if not is_ipa_file and not fstore.has_file(filename):
                     logger.debug("Backing up existing '%s'.", filename)
                     fstore.backup_file(filename)
+                # rewrite the file through the same file object
+                f.seek(0)
+                f.truncate()
 
-            with open(filename, "w") as f:
-                f.write("# created by IPA installer\n")
-                f.write("module: {}\n".format(module))
+            f.write(
+                "# created by IPA installer\n"
+                "module: {}\n"
                 # see man(5) pkcs11.conf
-                f.write("disable-in: {}\n".format(", ".join(disabled_in)))
-                os.fchmod(f.fileno(), 0o644)
-            self.restore_context(filename)
-            logger.debug("Created PKCS#11 module config '%s'.", filename)
-            filenames.append(filename)
+                "disable-in: {}\n".format(module, ", ".join(disabled_in))
+            )
+            os.fchmod(f.fileno(), 0o644)
+        self.restore_context(filename)
+        logger.debug("Created PKCS#11 module config '%s'.", filename)
+        return filename
 
-        return filenames
+    def configure_pkcs11_modules(self, fstore):
+        """Disable global p11-kit configuration for NSS
+        """
+        # Relabel all module configs with a single restorecon call. The
+        # configs are written one after another on purpose, FileStore
+        # backups are not thread-safe.
+        with self.batched_restorecon():
+            return [
+                self._configure_pkcs11_module(fstore, *entry)
+                for entry in PKCS11_MODULES
+            ]
 
     def restore_pkcs11_modules(self, fstore):
         """Restore global p11-kit configuration for NSS
@@ -184,17 +184,22 @@ class HTTPInstance(service.Service):
 
     def __configure_http(self):
         self.update_httpd_service_ipa_conf()
-        self.update_httpd_wsgi_conf()
-
-        # create /etc/httpd/alias, see https://pagure.io/freeipa/issue/7529
-        session_dir = os.path.dirname(self.sub_dict['GSSAPI_SESSION_KEY'])
-        if not os.path.isdir(session_dir):
-            os.makedirs(session_dir)
-        # Must be world-readable / executable
-        os.chmod(session_dir, 0o755)
-        # Restore SELinux context of session_dir /etc/httpd/alias, see
-        # https://pagure.io/freeipa/issue/7662
-        tasks.restore_context(session_dir)
+
+        # relabel WSGI config and session_dir with a single restorecon run
+        with tasks.batched_restorecon():
+            self.update_httpd_wsgi_conf()
+
+            # create /etc/httpd/alias, see
+            # https://pagure.io/freeipa/issue/7529
+            session_dir = os.path.dirname(
+                self.sub_dict['GSSAPI_SESSION_KEY'])
+            if not os.path.isdir(session_dir):
+                os.makedirs(session_dir)
+            # Must be world-readable / executable
+            os.chmod(session_dir, 0o755)
+            # Restore SELinux context of session_dir /etc/httpd/alias, see
+            # https://pagure.io/freeipa/issue/7662
+            tasks.restore_context(session_dir)
 
         target_fname = paths.HTTPD_IPA_CONF
         http_txt = ipautil.template_file(
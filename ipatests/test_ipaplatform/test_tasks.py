@@ -4,9 +4,11 @@
 from __future__ import absolute_import
 
 import os
+import types
 import pytest
 
 from ipaplatform.tasks import tasks
+from ipaplatform.redhat import tasks as redhat_tasks
 
 
 @pytest.mark.skip_if_platform(
@@ -15,15 +17,12 @@ from ipaplatform.tasks import tasks
 def test_ipa_version():
     v3 = tasks.parse_ipa_version('3.0')
     assert v3.version == u'3.0'
-    if hasattr(v3, '_rpmvercmp'):
-        assert v3._rpmvercmp_func is None
-        v3._rpmvercmp(b'1', b'2')
-        assert v3._rpmvercmp_func is not None
+    if isinstance(v3, redhat_tasks.IPAVersion):
+        assert redhat_tasks._rpmvercmp(b'1', b'2') < 0
+        assert redhat_tasks._RPMVERCMP is not None
 
     v4 = tasks.parse_ipa_version('4.0')
     assert v4.version == u'4.0'
-    if hasattr(v4, '_rpmvercmp'):
-        assert v4._rpmvercmp_func is not None
 
     # pylint: disable=comparison-with-itself
     assert v3 < v4
@@ -58,3 +57,110 @@ def test_detect_container():
 
     detected = tasks.detect_container()
     assert detected == container
+
+
+def test_batched_restorecon(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        redhat_tasks.ipautil, 'run', lambda args, **kwargs: calls.append(args)
+    )
+    # pretend restorecon is installed
+    monkeypatch.setattr(redhat_tasks, '_resolve_bin', lambda path: path)
+    ns = redhat_tasks.RedHatTaskNamespace()
+    ns._selinux_enabled = True
+    restorecon = redhat_tasks.paths.SBIN_RESTORECON
+
+    with ns.batched_restorecon():
+        ns.restore_context('/etc/a')
+        ns.restore_context('/etc/b', force=True)
+        with ns.batched_restorecon():
+            ns.restore_context('/etc/c')
+            ns.restore_context('/etc/a')
+        assert calls == []
+
+    assert calls == [
+        [restorecon, '/etc/a', '/etc/c'],
+        [restorecon, '-F', '/etc/b'],
+    ]
+
+    # outside of a batch files are relabeled right away
+    ns.restore_context('/etc/d')
+    assert calls[-1] == [restorecon, '/etc/d']
+
+
+def test_set_selinux_booleans_getsebool(monkeypatch):
+    getsebool = redhat_tasks.paths.GETSEBOOL
+    setsebool = redhat_tasks.paths.SETSEBOOL
+    outputs = {
+        (getsebool, '-a'): (
+            "httpd_can_network_connect --> off\n"
+            "httpd_use_nfs --> off pending: on\n"
+            "samba_share_nfs --> on\n"
+        ),
+        (getsebool, 'httpd_use_nfs'): "httpd_use_nfs --> off pending: on\n",
+        (getsebool, 'nis_enabled'): "nis_enabled --> off\n",
+    }
+    calls = []
+
+    def run(args, **kwargs):
+        calls.append(args)
+        return types.SimpleNamespace(output=outputs.get(tuple(args), ''))
+
+    monkeypatch.setattr(redhat_tasks.ipautil, 'run', run)
+    # exercise the getsebool code path
+    monkeypatch.setattr(redhat_tasks, '_load_libselinux', lambda: None)
+    ns = redhat_tasks.RedHatTaskNamespace()
+    ns._selinux_enabled = True
+
+    backup = {}
+    assert ns.set_selinux_booleans(
+        {
+            'httpd_can_network_connect': 'on',
+            'httpd_use_nfs': 'on',
+            'samba_share_nfs': 'on',
+            'nis_enabled': 'on',
+            'unset_boolean': None,
+        },
+        backup_func=backup.__setitem__
+    )
+
+    assert calls == [
+        # pending line and missing boolean fall back to a per-name query
+        [getsebool, '-a'],
+        [getsebool, 'httpd_use_nfs'],
+        [getsebool, 'nis_enabled'],
+        [setsebool, '-P', 'httpd_can_network_connect=on',
+         'httpd_use_nfs=on', 'nis_enabled=on'],
+    ]
+    assert backup == {
+        'httpd_can_network_connect': 'off',
+        'httpd_use_nfs': 'off',
+        'samba_share_nfs': 'on',
+        'nis_enabled': 'off',
+    }
+
+
+def test_set_nisdomain(monkeypatch, tmp_path):
+    network = tmp_path / 'network'
+    monkeypatch.setattr(redhat_tasks.paths, 'SYSCONF_NETWORK', str(network))
+    ns = redhat_tasks.RedHatTaskNamespace()
+
+    # missing file
+    ns.set_nisdomain('example.test')
+    assert network.read_text() == 'NISDOMAIN=example.test\n'
+
+    network.write_text(
+        'NETWORKING=yes\n'
+        '  NISDOMAIN=indented.test\n'
+        '\fNISDOMAIN=formfeed.test\n'
+        'nisdomain=lower.test\n'
+        'NISDOMAINFOO=keep\n'
+        'HOSTNAME=ipa.example.test'
+    )
+    ns.set_nisdomain('example.test')
+    assert network.read_text() == (
+        'NETWORKING=yes\n'
+        'NISDOMAINFOO=keep\n'
+        'HOSTNAME=ipa.example.test\n'
+        'NISDOMAIN=example.test\n'
+    )